@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from image_preprocessing import PREPROCESSING_PRESETS, decode_image, load_image, make_thumbnail, preprocess_image
+from saliency import occlusion_sensitivity, render_saliency_overlay
+
+
+class AnalysisRejected(RuntimeError):
+    """Raised when a job cannot be admitted because the queue or session limit is full."""
+
+
+class AnalysisJob:
+    """
+    State of a single preprocess + predict job for one lesion.
+
+    Status moves from "queued" to "running" to either "done" or "failed".
+    """
+
+    def __init__(self, session_id, payload):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.payload = payload
+        self.status = "queued"
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+
+    @property
+    def wait_seconds(self):
+        """Time spent queued before a worker picked the job up (so far, if still queued)."""
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.submitted_at
+
+    @property
+    def is_finished(self):
+        return self.status in ("done", "failed")
+
+
+class AnalysisExecutor:
+    """
+    Process-wide worker pool for image analysis shared by all app sessions.
+
+    Admission is bounded twice: a global cap on jobs waiting for a worker and
+    a per-session cap on jobs in flight. Callers submit a job, then poll it
+    on later reruns until it is finished and collect the result.
+    """
+
+    def __init__(self, model, max_workers=None, max_queue_size=16, max_in_flight_per_session=1,
+                 max_finished_jobs=256, max_images_per_job=6, saliency_options=None,
+                 preprocessing_preset="full"):
+        """
+        Args:
+            model: Classifier exposing predict_lesion(images)
+            max_workers: Number of worker threads (defaults to min(4, CPU count)); the
+                same number of threads is used to preprocess the photos of a job in parallel
+            max_queue_size: Maximum number of jobs waiting for a worker
+            max_in_flight_per_session: Maximum queued + running jobs per session
+            max_finished_jobs: Finished jobs kept for polling before the oldest are dropped
+            max_images_per_job: Maximum number of photos accepted for one lesion
+            saliency_options: Keyword arguments for saliency.occlusion_sensitivity; if
+                given, an occlusion map of the first photo is added to each result
+            preprocessing_preset: Name of an image_preprocessing.PREPROCESSING_PRESETS entry
+        """
+        if preprocessing_preset not in PREPROCESSING_PRESETS:
+            raise ValueError(
+                f"Unknown preprocessing preset '{preprocessing_preset}', "
+                f"expected one of {list(PREPROCESSING_PRESETS)}"
+            )
+        self.model = model
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_queue_size = max_queue_size
+        self.max_in_flight_per_session = max_in_flight_per_session
+        self.max_finished_jobs = max_finished_jobs
+        self.max_images_per_job = max_images_per_job
+        self.saliency_options = saliency_options
+        self._preprocess = partial(preprocess_image, preset=preprocessing_preset)
+
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analysis")
+        # Separate pool for per-photo preprocessing so jobs never wait on their own pool
+        self._preprocess_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="preprocess")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._in_flight = {}
+        self._recent_waits = deque(maxlen=100)
+
+    def submit(self, session_id, images):
+        """
+        Queue one or more photos of a lesion for preprocessing and prediction.
+
+        Args:
+            session_id: Identifier of the submitting session
+            images: Encoded image bytes as uploaded, or a decoded RGB array, PIL Image
+                or file path, or a list of them. Bytes are decoded on the worker,
+                so only the compressed upload waits in the queue
+
+        Returns:
+            The job ID to poll
+
+        Raises:
+            AnalysisRejected: If too many photos are submitted, the queue is full or
+                the session already has the maximum number of jobs in flight
+        """
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        if not images:
+            raise ValueError("At least one image is required")
+        if len(images) > self.max_images_per_job:
+            raise AnalysisRejected(f"Please upload at most {self.max_images_per_job} photos per lesion.")
+
+        with self._lock:
+            if self._in_flight.get(session_id, 0) >= self.max_in_flight_per_session:
+                raise AnalysisRejected("An analysis for this session is already in progress.")
+            if self._queued >= self.max_queue_size:
+                raise AnalysisRejected("The analysis queue is full. Please try again in a moment.")
+
+            job = AnalysisJob(session_id, list(images))
+            self._jobs[job.job_id] = job
+            self._queued += 1
+            self._in_flight[session_id] = self._in_flight.get(session_id, 0) + 1
+
+        self._pool.submit(self._run, job)
+        return job.job_id
+
+    def poll(self, job_id):
+        """
+        Returns:
+            The AnalysisJob for job_id, or None if it is unknown or has been collected
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def collect(self, job_id):
+        """
+        Remove a finished job and return it.
+
+        Returns:
+            The finished AnalysisJob, or None if it is unknown or not finished yet
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.is_finished:
+                return None
+            del self._jobs[job_id]
+            return job
+
+    def queue_position(self, job_id):
+        """
+        Returns:
+            1-based position of a queued job among queued jobs, or 0 if it is not queued
+        """
+        with self._lock:
+            position = 0
+            for job in self._jobs.values():
+                if job.status == "queued":
+                    position += 1
+                    if job.job_id == job_id:
+                        return position
+            return 0
+
+    def stats(self):
+        """
+        Returns:
+            Dictionary with queue depth, running jobs, worker count and recent wait times
+        """
+        with self._lock:
+            waits = np.array(self._recent_waits) if self._recent_waits else np.zeros(1)
+            return {
+                "queue_depth": self._queued,
+                "running": self._running,
+                "workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "avg_wait_seconds": float(np.mean(waits)),
+                "p95_wait_seconds": float(np.percentile(waits, 95)),
+            }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+        self._preprocess_pool.shutdown(wait=wait)
+
+    def _prepare(self, image):
+        """Decode one photo and return (display thumbnail, preprocessed array)."""
+        img_array = decode_image(image) if isinstance(image, bytes) else load_image(image)
+        return make_thumbnail(img_array), self._preprocess(img_array)
+
+    def _analyze(self, images):
+        """Decode and preprocess photos in parallel and score them in one batch; runs on a worker thread."""
+        if len(images) == 1:
+            prepared = [self._prepare(images[0])]
+        else:
+            prepared = list(self._preprocess_pool.map(self._prepare, images))
+        thumbnails = [thumbnail for thumbnail, _ in prepared]
+        processed_images = np.stack([processed for _, processed in prepared])
+        del prepared
+
+        prediction, confidence, per_image_predictions, agreement = self.model.predict_lesion(processed_images)
+        result = {
+            "thumbnails": thumbnails,
+            "preprocessed_images": processed_images,
+            "prediction": prediction,
+            "confidence": confidence,
+            "per_image_predictions": per_image_predictions,
+            "agreement": agreement,
+            "saliency_overlay": None,
+        }
+
+        if self.saliency_options is not None:
+            heatmap, _ = occlusion_sensitivity(self.model, processed_images[0], **self.saliency_options)
+            result["saliency_overlay"] = render_saliency_overlay(processed_images[0], heatmap, prediction)
+
+        return result
+
+    def _run(self, job):
+        with self._lock:
+            job.status = "running"
+            job.started_at = time.monotonic()
+            self._queued -= 1
+            self._running += 1
+            self._recent_waits.append(job.wait_seconds)
+
+        try:
+            result, error, status = self._analyze(job.payload), None, "done"
+        except Exception as e:
+            result, error, status = None, str(e), "failed"
+
+        with self._lock:
+            job.result = result
+            job.error = error
+            job.status = status
+            job.finished_at = time.monotonic()
+            job.payload = None
+            self._running -= 1
+            remaining = self._in_flight.get(job.session_id, 1) - 1
+            if remaining > 0:
+                self._in_flight[job.session_id] = remaining
+            else:
+                self._in_flight.pop(job.session_id, None)
+            self._drop_stale_jobs()
+
+    def _drop_stale_jobs(self):
+        """Drop the oldest finished jobs that were never collected (e.g. closed sessions)."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
@@ -1,23 +1,22 @@
 import streamlit as st
-import numpy as np
+import logging
 import os
-import tempfile
-from PIL import Image
-import io
 import time
+import uuid
 
 # Import custom modules
 from chatbot import ChatbotInterface
-from model import SkinLesionClassifier
-from image_preprocessing import preprocess_image
+from model import SkinLesionClassifier, HeuristicBackend, SavedModelBackend
+from analysis_executor import AnalysisExecutor, AnalysisRejected
+from storage import ConversationStore, DEFAULT_DB_PATH
 from utils import get_progress_placeholder, explain_prediction
-from assets.info_content import (
+from info_content import (
     get_app_description,
     get_disclaimer_text,
     get_educational_content,
     get_next_steps
 )
-from assets.sample_images import get_example_images
+from sample_images import get_example_images
 
 # Set page configuration
 st.set_page_config(
@@ -27,23 +26,70 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Only the most recent messages are kept in session state; the full history is in the store
+MAX_CHAT_HISTORY = 50
+
+# Durable storage for conversations and results, shared by all sessions
+@st.cache_resource
+def load_store():
+    return ConversationStore(os.environ.get("SCANTECH_DB_PATH", DEFAULT_DB_PATH))
+
+store = load_store()
+
 # Initialize session state variables if they don't exist
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 if "current_stage" not in st.session_state:
     st.session_state.current_stage = "introduction"
-if "uploaded_image" not in st.session_state:
-    st.session_state.uploaded_image = None
-if "preprocessed_image" not in st.session_state:
-    st.session_state.preprocessed_image = None
+if "uploaded_names" not in st.session_state:
+    st.session_state.uploaded_names = None
+if "thumbnails" not in st.session_state:
+    st.session_state.thumbnails = None
+if "preprocessed_images" not in st.session_state:
+    st.session_state.preprocessed_images = None
 if "prediction" not in st.session_state:
     st.session_state.prediction = None
 if "confidence" not in st.session_state:
     st.session_state.confidence = None
+if "image_predictions" not in st.session_state:
+    st.session_state.image_predictions = None
+if "agreement" not in st.session_state:
+    st.session_state.agreement = None
+if "saliency_overlay" not in st.session_state:
+    st.session_state.saliency_overlay = None
 if "user_responses" not in st.session_state:
     st.session_state.user_responses = {}
 if "chatbot" not in st.session_state:
     st.session_state.chatbot = ChatbotInterface()
+if "session_id" not in st.session_state:
+    # Resume a saved session if the URL names one, otherwise start a new one
+    requested_session = st.query_params.get("session")
+    saved = store.load_session(requested_session, max_messages=MAX_CHAT_HISTORY) if requested_session else None
+    if saved is not None:
+        st.session_state.session_id = requested_session
+        st.session_state.chat_history = saved["chat_history"]
+        st.session_state.current_stage = saved["current_stage"] or "introduction"
+        st.session_state.user_responses = saved["user_responses"]
+        if saved["result"] is not None:
+            st.session_state.prediction = saved["result"]["prediction"]
+            st.session_state.confidence = saved["result"]["confidence"]
+            st.session_state.image_predictions = saved["result"]["per_image_predictions"]
+            st.session_state.agreement = saved["result"]["agreement"]
+        
+        # Continue the medical questions where the user left off
+        chatbot = st.session_state.chatbot
+        if st.session_state.current_stage == "medical_history":
+            chatbot.current_question_idx = min(len(saved["user_responses"]) + 1, len(chatbot.medical_questions))
+        elif saved["user_responses"]:
+            chatbot.current_question_idx = len(chatbot.medical_questions)
+    else:
+        st.session_state.session_id = uuid.uuid4().hex
+        store.touch_session(st.session_state.session_id, st.session_state.current_stage)
+    st.query_params["session"] = st.session_state.session_id
+if "analysis_job" not in st.session_state:
+    st.session_state.analysis_job = None
+if "analysis_error" not in st.session_state:
+    st.session_state.analysis_error = None
 
 # Create main layout
 st.title("Skin Cancer Prediction Assistant")
@@ -72,13 +118,51 @@ with st.sidebar:
             with example_col2:
                 st.image(image_path, caption=label, use_column_width=True)
 
+# Saved models placed here join the simulated model in an ensemble
+MODELS_DIR = "models"
+
 # Initialize the model
 @st.cache_resource
 def load_model():
-    return SkinLesionClassifier()
+    members = [HeuristicBackend()]
+    if os.path.isdir(MODELS_DIR):
+        for filename in sorted(os.listdir(MODELS_DIR)):
+            if filename.endswith((".keras", ".h5")):
+                backend = SavedModelBackend(os.path.join(MODELS_DIR, filename))
+                # Load now so a corrupt file or missing TensorFlow skips this
+                # member instead of failing every analysis later
+                try:
+                    backend.load()
+                except Exception as e:
+                    logging.getLogger(__name__).warning("Skipping model %s: %s", filename, e)
+                    continue
+                members.append(backend)
+    return SkinLesionClassifier(members=members, combine="mean")
 
 model = load_model()
 
+# Shared worker pool so heavy uploads don't block the script thread and
+# concurrent sessions queue instead of competing for CPU
+@st.cache_resource
+def load_executor():
+    return AnalysisExecutor(
+        model,
+        max_queue_size=16,
+        max_in_flight_per_session=1,
+        # At most 100 occluded variants keeps the saliency map within interactive latency
+        saliency_options={"patch_size": 32, "stride": 16, "max_patches": 100},
+        # "full", "balanced" or "fast"; see image_preprocessing.PREPROCESSING_PRESETS
+        preprocessing_preset=os.environ.get("SCANTECH_PREPROCESSING_PRESET", "full")
+    )
+
+executor = load_executor()
+
+def add_chat_message(role, content):
+    """Append a message to the chat history and persist it."""
+    st.session_state.chat_history.append({"role": role, "content": content})
+    del st.session_state.chat_history[:-MAX_CHAT_HISTORY]
+    store.add_message(st.session_state.session_id, role, content)
+
 # Main content area
 col1, col2 = st.columns([3, 2])
 
@@ -99,15 +183,16 @@ with col1:
     if not st.session_state.chat_history or st.session_state.current_stage == "introduction":
         # Initial greeting
         welcome_msg = st.session_state.chatbot.get_welcome_message()
-        st.session_state.chat_history.append({"role": "assistant", "content": welcome_msg})
+        add_chat_message("assistant", welcome_msg)
         st.session_state.current_stage = "guidance"
+        store.touch_session(st.session_state.session_id, st.session_state.current_stage)
         st.rerun()
     
     # User input
     user_input = st.chat_input("Type your message here...")
     if user_input:
         # Add user message to chat history
-        st.session_state.chat_history.append({"role": "user", "content": user_input})
+        add_chat_message("user", user_input)
         
         # Process user message based on current stage
         response, next_stage = st.session_state.chatbot.process_message(
@@ -119,11 +204,13 @@ with col1:
         )
         
         # Add chatbot response to chat history
-        st.session_state.chat_history.append({"role": "assistant", "content": response})
+        add_chat_message("assistant", response)
+        store.save_responses(st.session_state.session_id, st.session_state.user_responses)
         
         # Update stage if changed
         if next_stage != st.session_state.current_stage:
             st.session_state.current_stage = next_stage
+            store.touch_session(st.session_state.session_id, next_stage)
         
         st.rerun()
 
@@ -131,43 +218,102 @@ with col2:
     # Image upload and results area
     st.header("Image Analysis")
     
-    # Image upload
-    uploaded_file = st.file_uploader("Upload an image of the skin lesion", type=["jpg", "jpeg", "png"])
+    # Image upload (several photos of the same lesion are scored together)
+    uploaded_files = st.file_uploader(
+        "Upload one or more images of the skin lesion",
+        type=["jpg", "jpeg", "png"],
+        accept_multiple_files=True,
+        help="Photos from different angles are analyzed together for a combined result."
+    )
     
-    if uploaded_file is not None and (st.session_state.uploaded_image is None or uploaded_file.name != st.session_state.uploaded_image.name):
-        # Process the new image
-        st.session_state.uploaded_image = uploaded_file
-        
-        # Display original image
-        image = Image.open(uploaded_file)
-        st.image(image, caption="Uploaded Image", use_column_width=True)
-        
-        # Process image
-        with st.spinner("Processing image..."):
-            # Preprocess the image
-            processed_img = preprocess_image(image)
-            st.session_state.preprocessed_image = processed_img
+    uploaded_names = [f.name for f in uploaded_files]
+    if uploaded_files and uploaded_names != st.session_state.uploaded_names:
+        try:
+            # Queue the compressed uploads on the shared worker pool; decoding and
+            # display thumbnails happen on the worker, so only bytes wait in the queue
+            st.session_state.analysis_job = executor.submit(
+                st.session_state.session_id, [f.getvalue() for f in uploaded_files]
+            )
+            st.session_state.uploaded_names = uploaded_names
+            st.session_state.thumbnails = None
+            st.session_state.analysis_error = None
+            st.rerun()
+        except AnalysisRejected as e:
+            st.warning(str(e))
+    
+    # Show why the current upload could not be analyzed
+    if st.session_state.analysis_error is not None:
+        st.error(st.session_state.analysis_error)
+    
+    # Poll the running analysis, if any
+    if st.session_state.analysis_job is not None:
+        job = executor.poll(st.session_state.analysis_job)
+        
+        if job is None:
+            # The job was dropped (e.g. after a server restart)
+            st.session_state.analysis_job = None
+        elif not job.is_finished:
+            st.caption("Uploaded: " + ", ".join(st.session_state.uploaded_names))
             
-            # Make prediction
+            stats = executor.stats()
             progress_placeholder = get_progress_placeholder(st)
+            if job.status == "queued":
+                progress_placeholder.progress(10)
+                position = executor.queue_position(job.job_id)
+                st.info(f"Waiting for a free analysis worker (position {position} of {stats['queue_depth']} in queue)...")
+            else:
+                progress_placeholder.progress(50)
+                st.info(f"Processing {len(st.session_state.uploaded_names)} image(s)...")
+            st.caption(
+                f"Queue depth: {stats['queue_depth']}/{stats['max_queue_size']} · "
+                f"Running: {stats['running']}/{stats['workers']} · "
+                f"Average wait: {stats['avg_wait_seconds']:.1f}s (p95 {stats['p95_wait_seconds']:.1f}s)"
+            )
+            timings = model.member_timings()
+            if timings:
+                st.caption("Model time (mean / p95): " + " · ".join(
+                    f"{name} {t['mean_ms']:.0f}/{t['p95_ms']:.0f} ms" if t["mean_ms"] is not None else f"{name} failing"
+                    for name, t in timings.items()
+                ))
             
-            for percent_complete in range(0, 101, 10):
-                time.sleep(0.1)  # Simulate processing time
-                progress_placeholder.progress(percent_complete)
-            
-            prediction_result, confidence = model.predict(processed_img)
-            st.session_state.prediction = prediction_result
-            st.session_state.confidence = confidence
+            time.sleep(0.5)
+            st.rerun()
+        else:
+            job = executor.collect(job.job_id)
+            st.session_state.analysis_job = None
             
-            # Update chat with the new information
-            if prediction_result is not None:
-                result_message = st.session_state.chatbot.get_prediction_message(
-                    prediction_result, confidence
+            if job.status == "failed":
+                # Keep the failed file names so the same upload is not resubmitted
+                # on every rerun; only a changed upload starts a new job
+                st.session_state.analysis_error = f"Could not analyze the images: {job.error}"
+            else:
+                st.session_state.thumbnails = job.result["thumbnails"]
+                st.session_state.preprocessed_images = job.result["preprocessed_images"]
+                prediction_result = job.result["prediction"]
+                confidence = job.result["confidence"]
+                st.session_state.prediction = prediction_result
+                st.session_state.confidence = confidence
+                st.session_state.image_predictions = job.result["per_image_predictions"]
+                st.session_state.agreement = job.result["agreement"]
+                st.session_state.saliency_overlay = job.result["saliency_overlay"]
+                store.add_result(
+                    st.session_state.session_id,
+                    prediction_result,
+                    confidence,
+                    per_image_predictions=job.result["per_image_predictions"],
+                    agreement=job.result["agreement"]
                 )
-                st.session_state.chat_history.append({"role": "assistant", "content": result_message})
-                st.session_state.current_stage = "post_prediction"
-        
-        st.rerun()
+                
+                # Update chat with the new information
+                if prediction_result is not None:
+                    result_message = st.session_state.chatbot.get_prediction_message(
+                        prediction_result, confidence
+                    )
+                    add_chat_message("assistant", result_message)
+                    st.session_state.current_stage = "post_prediction"
+                    store.touch_session(st.session_state.session_id, st.session_state.current_stage)
+                
+                st.rerun()
     
     # Display prediction results if available
     if st.session_state.prediction is not None and st.session_state.confidence is not None:
@@ -191,6 +337,29 @@ with col2:
         with col_result2:
             st.metric("Confidence", f"{st.session_state.confidence:.1f}%")
         
+        # Per-image breakdown when several photos were analyzed together
+        if st.session_state.image_predictions and len(st.session_state.image_predictions) > 1:
+            n_images = len(st.session_state.image_predictions)
+            n_agree = round(st.session_state.agreement * n_images)
+            st.metric("Image Agreement", f"{n_agree}/{n_images} photos")
+            if n_agree < n_images:
+                st.warning("The photos disagree. Consider retaking them in consistent lighting, or consult a dermatologist.")
+            
+            with st.expander("Per-image results"):
+                for name, (label, image_confidence) in zip(
+                    st.session_state.uploaded_names or [], st.session_state.image_predictions
+                ):
+                    st.write(f"**{name}**: {label} ({image_confidence:.1f}%)")
+        
+        # Occlusion-sensitivity map next to the uploaded image
+        if st.session_state.saliency_overlay is not None and st.session_state.thumbnails:
+            col_image, col_saliency = st.columns(2)
+            with col_image:
+                st.image(st.session_state.thumbnails[0], caption="Uploaded Image", use_column_width=True)
+            with col_saliency:
+                st.image(st.session_state.saliency_overlay, caption="Regions influencing the prediction", use_column_width=True)
+            st.caption("Warmer areas are regions where hiding part of the image most weakened the predicted result.")
+        
         # Explanation of the prediction
         st.subheader("Explanation")
         st.write(explain_prediction(st.session_state.prediction, st.session_state.confidence))
@@ -201,12 +370,21 @@ with col2:
         
         # Reset button
         if st.button("Start New Analysis"):
-            # Reset session state
+            # Reset session state and start a new stored session; the old one stays resumable
+            st.session_state.session_id = uuid.uuid4().hex
+            st.query_params["session"] = st.session_state.session_id
+            store.touch_session(st.session_state.session_id, "introduction")
             st.session_state.chat_history = []
             st.session_state.current_stage = "introduction"
-            st.session_state.uploaded_image = None
-            st.session_state.preprocessed_image = None
+            st.session_state.uploaded_names = None
+            st.session_state.thumbnails = None
+            st.session_state.preprocessed_images = None
+            st.session_state.analysis_job = None
+            st.session_state.analysis_error = None
             st.session_state.prediction = None
             st.session_state.confidence = None
+            st.session_state.image_predictions = None
+            st.session_state.agreement = None
+            st.session_state.saliency_overlay = None
             st.session_state.user_responses = {}
             st.rerun()
\ No newline at end of file
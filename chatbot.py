@@ -137,5 +137,4 @@ class ChatbotInterface:
                     
         else:
             # Default response if stage is not recognized
-            return "I'm here to help analyze skin lesions and provide guidance. Would you like to upload an image or ask questions about the process?", 
-current_stage
\ No newline at end of file
+            return "I'm here to help analyze skin lesions and provide guidance. Would you like to upload an image or ask questions about the process?", current_stage
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_preprocessing import preprocess_image
+
+INDEX_FILENAME = "index.json"
+LABELS_FILENAME = "labels.npy"
+CLASS_LABELS = ["Benign", "Melanoma"]
+SUPPORTED_DTYPES = ("uint8", "float16")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def build_shards(image_paths, labels, output_dir, target_size=(224, 224), dtype="uint8",
+                 shard_size=1024, n_workers=1, metadata=None):
+    """
+    Preprocess a dataset once and store it as fixed-shape memory-mapped shards.
+
+    Each shard is a ``.npy`` file of shape (count, height, width, 3) that can be
+    opened with ``np.load(..., mmap_mode="r")``. Labels are stored in a single
+    ``labels.npy`` and an ``index.json`` records the layout plus per-image metadata.
+
+    Args:
+        image_paths: List of image file paths
+        labels: List of integer labels (0 = Benign, 1 = Melanoma), one per image
+        output_dir: Directory to write the shards into
+        target_size: Target size passed to preprocess_image
+        dtype: Storage dtype, "uint8" (pixels in [0, 255]) or "float16" (pixels in [0, 1])
+        shard_size: Maximum number of images per shard
+        n_workers: Number of threads used to preprocess images
+        metadata: Optional list of JSON-serializable dicts, one per image
+
+    Returns:
+        The index dictionary that was written to ``index.json``
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported shard dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+    if len(image_paths) != len(labels):
+        raise ValueError("image_paths and labels must have the same length")
+    if metadata is not None and len(metadata) != len(image_paths):
+        raise ValueError("metadata must have one entry per image")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # cv2.resize takes (width, height), so the stored shape is (height, width, 3)
+    image_shape = (target_size[1], target_size[0], 3)
+    index = {
+        "dtype": dtype,
+        "image_shape": list(image_shape),
+        "target_size": list(target_size),
+        "class_labels": CLASS_LABELS,
+        "shards": [],
+        "records": [],
+    }
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for shard_idx, start in enumerate(range(0, len(image_paths), shard_size)):
+            shard_paths = image_paths[start:start + shard_size]
+            shard_file = f"shard_{shard_idx:05d}.npy"
+            shard = np.lib.format.open_memmap(
+                os.path.join(output_dir, shard_file),
+                mode="w+",
+                dtype=dtype,
+                shape=(len(shard_paths),) + image_shape,
+            )
+
+            processed = executor.map(lambda path: preprocess_image(path, target_size=target_size), shard_paths)
+            for offset, (path, img_array) in enumerate(zip(shard_paths, processed)):
+                shard[offset] = _encode(img_array, dtype)
+                record = {
+                    "source": path,
+                    "label": int(labels[start + offset]),
+                    "shard": shard_idx,
+                    "offset": offset,
+                }
+                if metadata is not None:
+                    record["metadata"] = metadata[start + offset]
+                index["records"].append(record)
+
+            shard.flush()
+            del shard
+            index["shards"].append({"file": shard_file, "count": len(shard_paths)})
+
+    np.save(os.path.join(output_dir, LABELS_FILENAME), np.asarray(labels, dtype=np.int8))
+    with open(os.path.join(output_dir, INDEX_FILENAME), "w") as f:
+        json.dump(index, f)
+
+    return index
+
+
+def _encode(img_array, dtype):
+    """Convert a preprocessed [0, 1] float image into the shard storage dtype."""
+    if dtype == "uint8":
+        return np.clip(np.rint(img_array * 255.0), 0, 255).astype(np.uint8)
+    return img_array.astype(np.float16)
+
+
+class ShardedDataset:
+    """
+    Read-only view over shards written by build_shards.
+
+    Batches are slices of the memory-mapped shards, so iterating does not
+    decode, preprocess or copy images; pages are read from disk on demand.
+    """
+
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, INDEX_FILENAME)) as f:
+            self.index = json.load(f)
+        self.shard_dir = shard_dir
+        self.dtype = np.dtype(self.index["dtype"])
+        self.labels = np.load(os.path.join(shard_dir, LABELS_FILENAME), mmap_mode="r")
+        self._shards = [
+            np.load(os.path.join(shard_dir, shard["file"]), mmap_mode="r")
+            for shard in self.index["shards"]
+        ]
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def records(self):
+        """Per-image metadata records (source path, label, shard and offset)."""
+        return self.index["records"]
+
+    def iter_batches(self, batch_size=32):
+        """
+        Yield (images, labels) batches without copying image data.
+
+        Batches never span two shards, so the last batch of each shard may be
+        smaller than batch_size; choose a shard_size that is a multiple of
+        batch_size to keep batches uniform.
+
+        Args:
+            batch_size: Maximum number of images per batch
+
+        Yields:
+            Tuples of (images, labels). ``images`` is a read-only memmap slice in the
+            shard dtype and can be passed directly to SkinLesionClassifier.predict_proba.
+        """
+        label_start = 0
+        for shard in self._shards:
+            for start in range(0, len(shard), batch_size):
+                stop = min(start + batch_size, len(shard))
+                yield shard[start:stop], self.labels[label_start + start:label_start + stop]
+            label_start += len(shard)
+
+    def to_model_input(self, images):
+        """Convert a batch to float32 in [0, 1], matching preprocess_image output."""
+        if self.dtype == np.uint8:
+            return images.astype(np.float32) / 255.0
+        return images.astype(np.float32)
+
+
+def find_labelled_images(images_dir):
+    """
+    Collect image paths and labels from a directory with one subfolder per class.
+
+    Args:
+        images_dir: Directory containing "Benign" and "Melanoma" subfolders
+
+    Returns:
+        Tuple of (image_paths, labels)
+    """
+    image_paths, labels = [], []
+    for label, class_name in enumerate(CLASS_LABELS):
+        class_dir = os.path.join(images_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for filename in sorted(os.listdir(class_dir)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                image_paths.append(os.path.join(class_dir, filename))
+                labels.append(label)
+    return image_paths, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess a labelled image folder into memory-mapped shards.")
+    parser.add_argument("images_dir", help="Directory with Benign/ and Melanoma/ subfolders")
+    parser.add_argument("output_dir", help="Directory to write shards into")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="uint8")
+    parser.add_argument("--shard-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    image_paths, labels = find_labelled_images(args.images_dir)
+    index = build_shards(
+        image_paths,
+        labels,
+        args.output_dir,
+        dtype=args.dtype,
+        shard_size=args.shard_size,
+        n_workers=args.workers,
+    )
+    print(f"Wrote {len(index['records'])} images into {len(index['shards'])} shards in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
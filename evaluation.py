@@ -0,0 +1,255 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class StreamingEvaluator:
+    """
+    Accumulates binary classification metrics batch by batch.
+
+    Scores are binned into a fixed-size histogram per class, so memory stays
+    constant regardless of how many images are evaluated. ROC, precision-recall
+    and threshold sweeps are derived from the histograms at the bin resolution;
+    the confusion matrix at the decision threshold is exact.
+
+    The two use different threshold rules. The confusion matrix counts a score
+    as melanoma when score > threshold, matching SkinLesionClassifier.predict.
+    Curve and sweep thresholds are bin lower edges, and a score counts as
+    melanoma at threshold t when its bin's lower edge is >= t, i.e. score >= t
+    up to the bin width.
+    """
+
+    def __init__(self, threshold=0.5, n_bins=1000, n_calibration_bins=10,
+                 specificity_targets=(0.80, 0.90, 0.95, 0.99)):
+        """
+        Args:
+            threshold: Decision threshold on the melanoma probability (score > threshold)
+            n_bins: Number of score bins used for the ROC / PR curves
+            n_calibration_bins: Number of equal-width bins for the calibration table
+            specificity_targets: Specificities to report the achievable sensitivity at
+        """
+        self.threshold = threshold
+        self.n_bins = n_bins
+        self.n_calibration_bins = n_calibration_bins
+        self.specificity_targets = tuple(specificity_targets)
+
+        self.positive_hist = np.zeros(n_bins, dtype=np.int64)
+        self.negative_hist = np.zeros(n_bins, dtype=np.int64)
+        self.calibration_count = np.zeros(n_calibration_bins, dtype=np.int64)
+        self.calibration_prob_sum = np.zeros(n_calibration_bins, dtype=np.float64)
+        self.calibration_positive = np.zeros(n_calibration_bins, dtype=np.int64)
+        self.tp = self.fp = self.tn = self.fn = 0
+
+    def update(self, probabilities, labels):
+        """
+        Add a batch of predictions.
+
+        Args:
+            probabilities: Array of melanoma probabilities in [0, 1]
+            labels: Array of true labels (1 = Melanoma, 0 = Benign)
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float64).ravel()
+        labels = np.asarray(labels).ravel().astype(bool)
+        if probabilities.shape != labels.shape:
+            raise ValueError("probabilities and labels must have the same length")
+
+        bins = np.clip((probabilities * self.n_bins).astype(np.int64), 0, self.n_bins - 1)
+        self.positive_hist += np.bincount(bins[labels], minlength=self.n_bins)
+        self.negative_hist += np.bincount(bins[~labels], minlength=self.n_bins)
+
+        cal_bins = np.clip((probabilities * self.n_calibration_bins).astype(np.int64), 0, self.n_calibration_bins - 1)
+        self.calibration_count += np.bincount(cal_bins, minlength=self.n_calibration_bins)
+        self.calibration_prob_sum += np.bincount(cal_bins, weights=probabilities, minlength=self.n_calibration_bins)
+        self.calibration_positive += np.bincount(cal_bins[labels], minlength=self.n_calibration_bins)
+
+        predicted = probabilities > self.threshold
+        self.tp += int(np.sum(predicted & labels))
+        self.fp += int(np.sum(predicted & ~labels))
+        self.tn += int(np.sum(~predicted & ~labels))
+        self.fn += int(np.sum(~predicted & labels))
+
+    def roc_curve(self):
+        """
+        Scores count as melanoma at a threshold when their bin's lower edge is >= it.
+
+        Returns:
+            Tuple of (false_positive_rates, true_positive_rates, thresholds), ordered by
+            decreasing threshold and starting at (0, 0). Rates are NaN if the
+            corresponding class has no samples.
+        """
+        # Count scores at or above each bin's lower edge, from the highest bin down
+        tp = np.concatenate([[0], np.cumsum(self.positive_hist[::-1])])
+        fp = np.concatenate([[0], np.cumsum(self.negative_hist[::-1])])
+        thresholds = np.concatenate([[1.0], np.arange(self.n_bins - 1, -1, -1) / self.n_bins])
+        tpr = tp / tp[-1] if tp[-1] else np.full(tp.shape, np.nan)
+        fpr = fp / fp[-1] if fp[-1] else np.full(fp.shape, np.nan)
+        return fpr, tpr, thresholds
+
+    def precision_recall_curve(self):
+        """
+        Scores count as melanoma at a threshold when their bin's lower edge is >= it.
+
+        Returns:
+            Tuple of (precision, recall, thresholds), ordered by decreasing threshold.
+            Recall is NaN if there are no melanoma samples.
+        """
+        tp = np.cumsum(self.positive_hist[::-1])
+        fp = np.cumsum(self.negative_hist[::-1])
+        thresholds = np.arange(self.n_bins - 1, -1, -1) / self.n_bins
+        predicted_positive = tp + fp
+        # Skip thresholds above the highest score, where precision is undefined
+        keep = predicted_positive > 0
+        precision = tp[keep] / predicted_positive[keep]
+        recall = tp[keep] / tp[-1] if tp[-1] else np.full(int(keep.sum()), np.nan)
+        return precision, recall, thresholds[keep]
+
+    def roc_auc(self):
+        """
+        Area under the ROC curve; ties within a bin count as half a correct ordering.
+        NaN if either class has no samples.
+        """
+        if not self.positive_hist.any() or not self.negative_hist.any():
+            return float("nan")
+        fpr, tpr, _ = self.roc_curve()
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2.0))
+
+    def average_precision(self):
+        """Step-wise area under the precision-recall curve; NaN without melanoma samples."""
+        if not self.positive_hist.any():
+            return float("nan")
+        precision, recall, _ = self.precision_recall_curve()
+        return float(np.sum(np.diff(np.concatenate([[0.0], recall])) * precision))
+
+    def calibration_bins(self):
+        """
+        Returns:
+            List of dicts with the bin range, mean predicted probability,
+            observed melanoma rate and sample count for each non-empty bin
+        """
+        result = []
+        for i in range(self.n_calibration_bins):
+            count = int(self.calibration_count[i])
+            if count == 0:
+                continue
+            result.append({
+                "bin_start": i / self.n_calibration_bins,
+                "bin_end": (i + 1) / self.n_calibration_bins,
+                "mean_predicted": float(self.calibration_prob_sum[i] / count),
+                "observed_rate": float(self.calibration_positive[i] / count),
+                "count": count,
+            })
+        return result
+
+    def sensitivity_at_specificity(self):
+        """
+        Thresholds follow the curve rule: melanoma when score >= threshold, at
+        bin resolution.
+
+        Returns:
+            List of dicts with the target specificity, the highest sensitivity
+            achievable at or above it and the threshold that achieves it; values
+            are NaN if either class has no samples
+        """
+        if not self.positive_hist.any() or not self.negative_hist.any():
+            return [
+                {"specificity_target": target, "sensitivity": float("nan"),
+                 "specificity": float("nan"), "threshold": float("nan")}
+                for target in self.specificity_targets
+            ]
+        fpr, tpr, thresholds = self.roc_curve()
+        specificity = 1.0 - fpr
+        sweep = []
+        for target in self.specificity_targets:
+            eligible = np.flatnonzero(specificity >= target)
+            # tpr grows as the threshold drops, so the last eligible point is the best one
+            best = eligible[-1]
+            sweep.append({
+                "specificity_target": target,
+                "sensitivity": float(tpr[best]),
+                "specificity": float(specificity[best]),
+                "threshold": float(thresholds[best]),
+            })
+        return sweep
+
+    def result(self):
+        """
+        Returns:
+            Dictionary of evaluation metrics. Every metric whose denominator is
+            zero (e.g. specificity without benign samples) is NaN
+        """
+        total = self.tp + self.fp + self.tn + self.fn
+        precision = _ratio(self.tp, self.tp + self.fp)
+        recall = _ratio(self.tp, self.tp + self.fn)
+        # Equal to 2PR / (P + R) whenever both are defined
+        f1_score = _ratio(2 * self.tp, 2 * self.tp + self.fp + self.fn)
+        specificity = _ratio(self.tn, self.tn + self.fp)
+
+        fpr, tpr, roc_thresholds = self.roc_curve()
+        pr_precision, pr_recall, pr_thresholds = self.precision_recall_curve()
+
+        return {
+            "accuracy": _ratio(self.tp + self.tn, total),
+            "precision": precision,
+            "recall": recall,
+            "f1_score": f1_score,
+            "specificity": specificity,
+            "n_samples": total,
+            "confusion_matrix": [[self.tn, self.fp], [self.fn, self.tp]],
+            "roc_auc": self.roc_auc(),
+            "average_precision": self.average_precision(),
+            "roc_curve": {
+                "fpr": fpr.tolist(),
+                "tpr": tpr.tolist(),
+                "thresholds": roc_thresholds.tolist(),
+            },
+            "pr_curve": {
+                "precision": pr_precision.tolist(),
+                "recall": pr_recall.tolist(),
+                "thresholds": pr_thresholds.tolist(),
+            },
+            "calibration": self.calibration_bins(),
+            "sensitivity_at_specificity": self.sensitivity_at_specificity(),
+        }
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else float("nan")
+
+
+def evaluate_batches(predict_proba, batches, n_workers=1, **evaluator_kwargs):
+    """
+    Score an iterator of (images, labels) batches and accumulate metrics.
+
+    Batches are pulled lazily and at most 2 * n_workers are in flight at once,
+    so memory stays bounded no matter how long the iterator is.
+
+    Args:
+        predict_proba: Callable mapping an image batch to melanoma probabilities
+        batches: Iterable of (images, labels) tuples
+        n_workers: Number of threads scoring batches concurrently
+        **evaluator_kwargs: Passed through to StreamingEvaluator
+
+    Returns:
+        Dictionary of evaluation metrics (see StreamingEvaluator.result)
+    """
+    evaluator = StreamingEvaluator(**evaluator_kwargs)
+
+    if n_workers <= 1:
+        for images, labels in batches:
+            evaluator.update(predict_proba(images), labels)
+        return evaluator.result()
+
+    max_in_flight = 2 * n_workers
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for images, labels in batches:
+            pending.append((executor.submit(predict_proba, images), labels))
+            if len(pending) >= max_in_flight:
+                future, batch_labels = pending.popleft()
+                evaluator.update(future.result(), batch_labels)
+        while pending:
+            future, batch_labels = pending.popleft()
+            evaluator.update(future.result(), batch_labels)
+
+    return evaluator.result()
@@ -0,0 +1,323 @@
+"""
+Concurrent-session load test for the Streamlit app.
+
+Each simulated user drives app.py through Streamlit's headless AppTest API:
+welcome flow, guidance, the medical questions, an upload of synthetic photos
+through the app's own file uploader, and post-prediction questions. The upload
+goes through the app's upload branch, its cached model ensemble and analysis
+executor, and its polling loop, so analysis latency includes queueing and the
+0.5 s poll interval exactly as a real user sees it. AppTest only supports
+st.file_uploader in recent Streamlit releases; older ones are rejected at start.
+
+AppTest installs a process-wide mock runtime for every run, so concurrent
+AppTests in one process interfere with each other. Each simulated user
+therefore runs in its own process, with its own copy of the app's cached
+model, executor and store. Users compete for CPU as sessions on one server
+would, but not for the app's shared queue: queue saturation and the app's
+admission limits are not measured, and the report says so. Each process first
+runs an untimed warm-up session; "app MB" is its RSS growth (loading the app
+and first use of the analysis path), and "MB/session" is the growth caused by
+the measured session, which is kept alive, on top of that.
+
+The conversation database is written to a temporary directory (or --db-path)
+through SCANTECH_DB_PATH, never to the production database.
+
+Usage:
+    python load_test.py --users 1 5 10 25 --images-per-user 2
+"""
+import argparse
+import importlib
+import io
+import os
+import tempfile
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+APP_MODULES = ["analysis_executor", "chatbot", "image_preprocessing", "model", "storage", "utils"]
+# Offset for the synthetic photos of warm-up sessions, distinct from the measured users' seeds
+WARM_UP_SEED = 10_000
+
+MEDICAL_ANSWERS = [
+    "About six months",
+    "Yes, it has gotten a little darker",
+    "No family history that I know of",
+    "Yes, several sunburns as a child",
+    "It is itchy sometimes",
+    "No previous skin cancers",
+]
+
+POST_PREDICTION_QUESTIONS = [
+    "Can you explain which features you looked for?",
+    "What should I do next?",
+    "Thanks",
+]
+
+
+def make_synthetic_lesion(seed, size=(480, 640)):
+    """
+    Generate a JPEG of a lesion-like blob on a skin-toned background with hair strands.
+
+    Returns:
+        JPEG-encoded bytes
+    """
+    rng = np.random.default_rng(seed)
+    height, width = size
+    skin = np.array([225, 180, 150]) + rng.integers(-25, 25, size=3)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = np.clip(skin, 0, 255)
+    image = np.clip(image + rng.normal(0, 6, image.shape), 0, 255).astype(np.uint8)
+
+    center = (int(width / 2 + rng.integers(-60, 60)), int(height / 2 + rng.integers(-60, 60)))
+    axes = (int(rng.integers(40, 120)), int(rng.integers(40, 120)))
+    lesion_color = tuple(int(c) for c in rng.integers(40, 120, size=3))
+    cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, lesion_color, -1)
+
+    for _ in range(int(rng.integers(3, 12))):
+        start = tuple(int(v) for v in rng.integers(0, [width, height]))
+        end = tuple(int(v) for v in rng.integers(0, [width, height]))
+        cv2.line(image, start, end, (30, 25, 20), 1)
+
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _timed_run(at, rerun_ms):
+    start = time.perf_counter()
+    at.run()
+    rerun_ms.append((time.perf_counter() - start) * 1000)
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return at
+
+
+def _upload(at, photos, timeout, retry_interval=0.25):
+    """
+    Upload photos through the app and rerun until its polling loop stores a result.
+
+    The app's polling reruns happen inside at.run(), so one run normally covers
+    queueing and analysis. A rejected upload (full queue or session limit) is
+    never recorded as submitted, so the next run resubmits it.
+
+    Returns:
+        Number of times the upload was rejected
+
+    Raises:
+        RuntimeError: If the analysis failed or the app dropped the job without a result
+        TimeoutError: If no result arrived within timeout seconds
+    """
+    files = [(f"lesion_{idx}.jpg", data, "image/jpeg") for idx, data in enumerate(photos)]
+    names = [name for name, _, _ in files]
+    at.file_uploader[0].set_value(files)
+
+    deadline = time.monotonic() + timeout
+    rejections = 0
+    while True:
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        if at.session_state["prediction"] is not None:
+            return rejections
+        if at.session_state["analysis_error"] is not None:
+            raise RuntimeError(at.session_state["analysis_error"])
+        if at.session_state["analysis_job"] is None:
+            if at.session_state["uploaded_names"] == names:
+                raise RuntimeError("The app dropped the analysis job without a result")
+            rejections += 1
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"No analysis result within {timeout:.0f}s ({rejections} rejections)")
+        time.sleep(retry_interval)
+
+
+def _run_session(seed, images_per_user, timeout, rerun_ms):
+    """
+    Drive one AppTest session through the full conversation.
+
+    Returns:
+        Tuple of (AppTest, analysis latency in ms, rejection count)
+    """
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    # Welcome flow, then agree to proceed past the guidance message
+    _timed_run(at, rerun_ms)
+    at.chat_input[0].set_value("yes")
+    _timed_run(at, rerun_ms)
+
+    for answer in MEDICAL_ANSWERS:
+        at.chat_input[0].set_value(answer)
+        _timed_run(at, rerun_ms)
+
+    # Upload through the app; the result also moves the chat to post_prediction
+    photos = [make_synthetic_lesion(seed * 100 + i) for i in range(images_per_user)]
+    start = time.perf_counter()
+    rejections = _upload(at, photos, timeout)
+    analysis_ms = (time.perf_counter() - start) * 1000
+
+    for question in POST_PREDICTION_QUESTIONS:
+        at.chat_input[0].set_value(question)
+        _timed_run(at, rerun_ms)
+
+    return at, analysis_ms, rejections
+
+
+def simulate_user(user_idx, images_per_user, timeout, start_barrier):
+    """
+    Drive one simulated user through the full conversation; runs in a worker process.
+
+    An untimed warm-up session first loads the app and its cached resources and
+    exercises the analysis path once. All workers then wait on start_barrier,
+    so the measured sessions run concurrently, and the measured session is kept
+    alive until its memory has been read.
+
+    Returns:
+        Dictionary with the user's rerun latencies, analysis latency, rejection
+        count, start and end times, and the RSS growth in bytes of the warm-up
+        (app load) and of the measured session
+    """
+    rss_start = _rss_bytes()
+    warm_up_session, _, _ = _run_session(WARM_UP_SEED + user_idx, images_per_user, timeout, [])
+    rss_app = _rss_bytes()
+
+    start_barrier.wait()
+    started_at = time.time()
+    rerun_ms = []
+    session, analysis_ms, rejections = _run_session(user_idx, images_per_user, timeout, rerun_ms)
+    finished_at = time.time()
+    rss_end = _rss_bytes()
+
+    return {
+        "rerun_ms": rerun_ms,
+        "analysis_ms": analysis_ms,
+        "rejections": rejections,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "app_rss_growth": rss_app - rss_start if rss_start is not None else None,
+        "rss_growth": rss_end - rss_app if rss_start is not None else None,
+    }
+
+
+def _rss_bytes():
+    """Resident set size of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _warm_up():
+    """Import the app's modules before a worker process starts timing."""
+    for name in APP_MODULES:
+        importlib.import_module(name)
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def run_load_level(n_users, images_per_user=1, timeout=60):
+    """
+    Run n_users simulated users concurrently, one process each.
+
+    Throughput is measured over the measured sessions, from the first user's
+    start to the last user's end, so process start-up and warm-up are excluded.
+
+    Returns:
+        Dictionary with rerun and analysis latency percentiles (ms), RSS growth of
+        loading the app and per session, throughput and error counts
+    """
+    # Fresh interpreters, so no Streamlit or cache state is inherited from this one
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, \
+            ProcessPoolExecutor(max_workers=n_users, mp_context=context, initializer=_warm_up) as pool:
+        # A user whose warm-up fails breaks the barrier instead of stalling the others
+        start_barrier = manager.Barrier(n_users, timeout=timeout * 2)
+        futures = [
+            pool.submit(simulate_user, idx, images_per_user, timeout, start_barrier)
+            for idx in range(n_users)
+        ]
+        outcomes = []
+        errors = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                errors.append(str(e))
+
+    elapsed = (
+        max(outcome["finished_at"] for outcome in outcomes) - min(outcome["started_at"] for outcome in outcomes)
+        if outcomes else float("nan")
+    )
+    rerun_ms = [ms for outcome in outcomes for ms in outcome["rerun_ms"]]
+    analysis_ms = [outcome["analysis_ms"] for outcome in outcomes]
+    app_rss_growth = [outcome["app_rss_growth"] for outcome in outcomes if outcome["app_rss_growth"] is not None]
+    rss_growth = [outcome["rss_growth"] for outcome in outcomes if outcome["rss_growth"] is not None]
+
+    return {
+        "users": n_users,
+        "completed": len(outcomes),
+        "errors": errors,
+        "rerun_ms": _percentiles(rerun_ms),
+        "analysis_ms": _percentiles(analysis_ms),
+        "rejections": sum(outcome["rejections"] for outcome in outcomes),
+        "app_memory_mb": float(np.mean(app_rss_growth)) / 2 ** 20 if app_rss_growth else None,
+        "memory_per_session_mb": float(np.mean(rss_growth)) / 2 ** 20 if rss_growth else None,
+        "users_per_second": len(outcomes) / elapsed,
+        "reruns_per_second": len(rerun_ms) / elapsed,
+        "elapsed_seconds": elapsed,
+    }
+
+
+def _format_ms(stats):
+    return " / ".join("-" if v is None else f"{v:.0f}" for v in (stats["p50"], stats["p95"], stats["p99"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app.py.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10, 25],
+                        help="Concurrent user counts to test, in increasing order")
+    parser.add_argument("--images-per-user", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="Per-run timeout in seconds; the upload run includes the whole analysis")
+    parser.add_argument("--db-path", default=None,
+                        help="Conversation database to write (defaults to a temporary file)")
+    args = parser.parse_args()
+
+    if not hasattr(AppTest, "file_uploader"):
+        parser.error("this Streamlit release's AppTest cannot drive st.file_uploader; upgrade Streamlit")
+
+    with tempfile.TemporaryDirectory(prefix="scantech-load-", ignore_cleanup_errors=True) as tmp_dir:
+        # Read by load_store() in app.py on the first run
+        os.environ["SCANTECH_DB_PATH"] = args.db_path or os.path.join(tmp_dir, "sessions.db")
+
+        print("Each user runs in its own app process with its own analysis queue, so queue")
+        print("saturation and the app's admission limits are NOT measured; 'rejected' only")
+        print("counts rejections by a user's own app instance.")
+        print(f"{'users':>5}  {'rerun ms p50/p95/p99':>22}  {'analysis ms p50/p95/p99':>24}  {'app MB':>6}  "
+              f"{'MB/session':>10}  {'users/s':>7}  {'reruns/s':>8}  {'rejected':>8}  {'errors':>6}")
+        for n_users in args.users:
+            report = run_load_level(n_users, args.images_per_user, args.timeout)
+            app_memory = report["app_memory_mb"]
+            memory = report["memory_per_session_mb"]
+            print(
+                f"{n_users:>5}  {_format_ms(report['rerun_ms']):>22}  {_format_ms(report['analysis_ms']):>24}  "
+                f"{'-' if app_memory is None else f'{app_memory:.1f}':>6}  "
+                f"{'-' if memory is None else f'{memory:.1f}':>10}  {report['users_per_second']:>7.2f}  "
+                f"{report['reruns_per_second']:>8.1f}  {report['rejections']:>8}  {len(report['errors']):>6}"
+            )
+            for error in report["errors"][:3]:
+                print(f"       error: {error}")
+
+
+if __name__ == "__main__":
+    main()
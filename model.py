@@ -1,51 +1,310 @@
 import numpy as np
+import logging
 import os
 import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-class SkinLesionClassifier:
+from evaluation import evaluate_batches
+
+COMBINE_METHODS = ("mean", "vote")
+
+logger = logging.getLogger(__name__)
+
+class HeuristicBackend:
     """
-    A class to handle the skin lesion classification model.
-    In a production environment, this would load a pre-trained model.
-    For this prototype, we simulate a model with representative behavior.
+    Simulated model used by the prototype.
+    It scores images from simple color and texture features plus randomness.
     """
     
-    def __init__(self):
-        """Initialize the classifier (simplified for demo)."""
-        # No actual model initialization needed for the simulation
-        pass
-        
-    def predict(self, image):
+    def __init__(self, name="heuristic"):
+        self.name = name
+    
+    def predict_proba(self, images, stochastic=True):
         """
-        Predict whether the lesion is melanoma or benign.
+        Compute the melanoma probability for a batch of images.
+        
+        uint8 batches are scored without converting them to float first, so
+        slices of memory-mapped shards can be passed in as-is.
         
         Args:
-            image: Preprocessed image array of shape (224, 224, 3)
+            images: Array of shape (N, 224, 224, 3)
+            stochastic: If False, replace the simulated noise with its expected
+                value so repeated calls (e.g. occlusion maps) are comparable
             
         Returns:
-            Tuple of (prediction_label, confidence_percentage)
+            Array of shape (N,) with melanoma probabilities
         """
         # For this prototype, we're simulating model predictions
         # In a real implementation, this would use the trained model
+        images = np.asarray(images)
+        n_images = images.shape[0]
         
-        # Simulated prediction
-        # We'll use some image features to influence the simulated prediction
-        # to make it somewhat realistic
+        # uint8 inputs are on a 0-255 scale; rescale the extracted features
+        # instead of the pixels to avoid materializing a float copy
+        scale = 255.0 if images.dtype == np.uint8 else 1.0
         
-        # Extract basic image features
-        avg_brightness = np.mean(image)
-        avg_red_channel = np.mean(image[:,:,0]) if image.shape[-1] >= 3 else 0
-        texture_variance = np.std(image)
+        # Extract basic image features per image. The standard deviation is taken
+        # one image at a time so the float64 temporary stays the size of one image
+        avg_red_channel = images[..., 0].mean(axis=(1, 2), dtype=np.float64) / scale
+        texture_variance = np.fromiter(
+            (image.std(dtype=np.float64) for image in images), dtype=np.float64, count=n_images
+        ) / scale
         
         # Use image features to influence prediction
         # Higher red channel values and texture variance might correlate with melanoma
         melanoma_factor = (avg_red_channel / 255.0) * 0.7 + (texture_variance / 50.0) * 0.3
         
         # Add randomness for demonstration
-        melanoma_probability = melanoma_factor * 0.7 + random.random() * 0.3
+        if stochastic:
+            noise = np.array([random.random() for _ in range(n_images)])
+        else:
+            noise = np.full(n_images, 0.5)
+        melanoma_probability = melanoma_factor * 0.7 + noise * 0.3
         
         # Cap probability between 0.1 and 0.9 to avoid extreme predictions
-        melanoma_probability = max(0.1, min(0.9, melanoma_probability))
+        return np.clip(melanoma_probability, 0.1, 0.9)
+
+class SavedModelBackend:
+    """
+    A trained Keras model saved to disk, loaded lazily on first use.
+    """
+    
+    def __init__(self, path, name=None, melanoma_index=1):
+        """
+        Args:
+            path: Path to a saved Keras model (.keras, .h5 or SavedModel directory)
+            name: Member name used in timings (defaults to the file name)
+            melanoma_index: Output column holding the melanoma probability for
+                softmax models; ignored for single-output sigmoid models
+        """
+        self.path = path
+        self.name = name or os.path.basename(os.path.normpath(path))
+        self.melanoma_index = melanoma_index
+        self._model = None
+        self._load_lock = threading.Lock()
+    
+    def predict_proba(self, images, stochastic=True):
+        """
+        Compute the melanoma probability for a batch of images.
+        
+        Args:
+            images: Array of shape (N, 224, 224, 3), float in [0, 1] or uint8
+            stochastic: Ignored; saved models are deterministic
+            
+        Returns:
+            Array of shape (N,) with melanoma probabilities
+        """
+        model = self.load()
+        if images.dtype == np.uint8:
+            images = images.astype(np.float32) / 255.0
+        
+        outputs = np.asarray(model.predict(images, verbose=0))
+        if outputs.ndim == 1 or outputs.shape[-1] == 1:
+            return outputs.reshape(-1)
+        return outputs[:, self.melanoma_index]
+    
+    def load(self):
+        """
+        Load the model now instead of on first use, e.g. to reject a corrupt file early.
+        
+        Returns:
+            The loaded Keras model
+        """
+        with self._load_lock:
+            if self._model is None:
+                # TensorFlow is only needed when a saved model is actually used
+                import tensorflow as tf
+                self._model = tf.keras.models.load_model(self.path)
+            return self._model
+
+class SkinLesionClassifier:
+    """
+    A class to handle the skin lesion classification model.
+    
+    The classifier wraps one or more members (backends exposing
+    predict_proba(images, stochastic)). By default it has a single simulated
+    member; with several members it acts as an ensemble.
+    """
+    
+    def __init__(self, members=None, combine="mean", weights=None):
+        """
+        Initialize the classifier.
+        
+        Args:
+            members: List of backends; defaults to [HeuristicBackend()]
+            combine: "mean" for (weighted) probability averaging, or "vote" for
+                (weighted) majority voting
+            weights: Optional per-member weights, normalized to sum to 1
+        """
+        self.members = list(members) if members else [HeuristicBackend()]
+        if combine not in COMBINE_METHODS:
+            raise ValueError(f"Unknown combine method '{combine}', expected one of {COMBINE_METHODS}")
+        names = [member.name for member in self.members]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Member names must be unique, got {names}")
+        
+        weights = np.ones(len(self.members)) if weights is None else np.asarray(weights, dtype=np.float64)
+        if weights.shape != (len(self.members),) or np.any(weights < 0) or weights.sum() == 0:
+            raise ValueError("weights must be non-negative, one per member, and not all zero")
+        self.combine = combine
+        self.weights = weights / weights.sum()
+        
+        # One thread per member so all members score a batch at the same time
+        self._pool = None
+        if len(self.members) > 1:
+            self._pool = ThreadPoolExecutor(max_workers=len(self.members), thread_name_prefix="ensemble")
+        self._timings = {name: deque(maxlen=100) for name in names}
+        self._failures = {name: 0 for name in names}
+        self._timings_lock = threading.Lock()
+        
+    def predict(self, image):
+        """
+        Predict whether the lesion is melanoma or benign.
+        
+        Args:
+            image: Preprocessed image array of shape (224, 224, 3)
+            
+        Returns:
+            Tuple of (prediction_label, confidence_percentage)
+        """
+        melanoma_probability = self.predict_proba(image[np.newaxis])[0]
+        return self._label_probability(melanoma_probability)
+    
+    def predict_batch(self, images):
+        """
+        Predict a batch of lesions in a single vectorized call.
+        
+        Args:
+            images: Array of shape (N, 224, 224, 3), either float in [0, 1]
+                or uint8 in [0, 255] (e.g. a memory-mapped shard slice)
+            
+        Returns:
+            List of (prediction_label, confidence_percentage) tuples
+        """
+        return [self._label_probability(p) for p in self.predict_proba(images)]
+    
+    def predict_lesion(self, images):
+        """
+        Predict a single lesion from several photos of it.
+        
+        All photos are scored in one batched call and their melanoma
+        probabilities are averaged into a combined prediction.
+        
+        Args:
+            images: Array of shape (N, 224, 224, 3) with N photos of the same lesion
+            
+        Returns:
+            Tuple of (prediction_label, confidence_percentage, per_image_predictions, agreement)
+            where per_image_predictions is a list of (prediction_label, confidence_percentage)
+            and agreement is the fraction of photos whose label matches the combined one
+        """
+        probabilities = self.predict_proba(images)
+        prediction, confidence = self._label_probability(float(np.mean(probabilities)))
+        per_image_predictions = [self._label_probability(p) for p in probabilities]
+        agreement = sum(label == prediction for label, _ in per_image_predictions) / len(per_image_predictions)
         
+        return prediction, confidence, per_image_predictions, agreement
+    
+    def predict_proba(self, images, stochastic=True):
+        """
+        Compute the melanoma probability for a batch of images.
+        
+        With several members, every member scores the same batch concurrently
+        on the classifier's thread pool and the results are combined, so the
+        latency is close to that of the slowest member. A member that raises is
+        logged and left out, and the remaining members' weights are renormalized.
+        
+        Args:
+            images: Array of shape (N, 224, 224, 3)
+            stochastic: Passed to the members; if False, simulated members are
+                deterministic so repeated calls (e.g. occlusion maps) are comparable
+            
+        Returns:
+            Array of shape (N,) with melanoma probabilities
+            
+        Raises:
+            RuntimeError: If every member with a non-zero weight failed
+        """
+        images = np.asarray(images)
+        if len(self.members) == 1:
+            return self._score_member(self.members[0], images, stochastic)
+        
+        # All members read the same preprocessed batch; make it read-only so
+        # one member cannot change what another sees
+        shared = images.view()
+        shared.flags.writeable = False
+        
+        futures = [
+            self._pool.submit(self._score_member, member, shared, stochastic)
+            for member in self.members
+        ]
+        succeeded = []
+        member_probabilities = []
+        for idx, (member, future) in enumerate(zip(self.members, futures)):
+            try:
+                member_probabilities.append(future.result())
+                succeeded.append(idx)
+            except Exception as e:
+                with self._timings_lock:
+                    self._failures[member.name] += 1
+                logger.warning("Ensemble member %s failed and was left out: %s", member.name, e)
+        
+        weights = self.weights[succeeded]
+        if weights.sum() == 0:
+            raise RuntimeError("No ensemble member with a non-zero weight succeeded; see the log for details")
+        
+        return self._combine(np.stack(member_probabilities), weights / weights.sum())
+    
+    def member_timings(self):
+        """
+        Returns:
+            Dictionary mapping member name to its last, mean and p95 scoring time
+            in milliseconds over the most recent successful calls (None if it has
+            none yet) and its number of failed calls, for members that were called
+        """
+        with self._timings_lock:
+            return {
+                name: {
+                    "last_ms": timings[-1] if timings else None,
+                    "mean_ms": float(np.mean(timings)) if timings else None,
+                    "p95_ms": float(np.percentile(timings, 95)) if timings else None,
+                    "failures": self._failures[name],
+                }
+                for name, timings in self._timings.items() if timings or self._failures[name]
+            }
+    
+    def _score_member(self, member, images, stochastic):
+        start = time.perf_counter()
+        probabilities = np.asarray(member.predict_proba(images, stochastic=stochastic), dtype=np.float64)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._timings_lock:
+            self._timings[member.name].append(elapsed_ms)
+        return probabilities
+    
+    def _combine(self, member_probabilities, weights):
+        """Combine (members, N) probabilities into (N,) with per-member weights summing to 1."""
+        weights = weights[:, np.newaxis]
+        weighted_mean = (weights * member_probabilities).sum(axis=0)
+        if self.combine == "mean":
+            return weighted_mean
+        
+        # Weighted majority vote; the probability is the mean of the members in the majority
+        votes = member_probabilities > 0.5
+        melanoma_share = (weights * votes).sum(axis=0)
+        majority = melanoma_share > 0.5
+        agreeing = weights * (votes == majority)
+        combined = (agreeing * member_probabilities).sum(axis=0) / agreeing.sum(axis=0)
+        
+        # Fall back to the weighted mean when the vote is tied
+        tied = np.isclose(melanoma_share, 0.5)
+        combined[tied] = weighted_mean[tied]
+        return combined
+    
+    def _label_probability(self, melanoma_probability):
+        """Map a melanoma probability to (prediction_label, confidence_percentage)."""
         # Get class index and confidence
         class_idx = 1 if melanoma_probability > 0.5 else 0
         confidence = melanoma_probability * 100 if class_idx == 1 else (1 - melanoma_probability) * 100
@@ -54,26 +313,34 @@ class SkinLesionClassifier:
         class_labels = ["Benign", "Melanoma"]
         prediction = class_labels[class_idx]
         
-        return prediction, confidence
+        return prediction, float(confidence)
         
-    def evaluate(self, test_images, test_labels):
+    def evaluate(self, test_images, test_labels=None, batch_size=32, n_workers=1, **evaluator_kwargs):
         """
         Evaluate the model on a test set.
         
+        Metrics are accumulated batch by batch, so memory use does not grow with
+        the size of the test set.
+        
         Args:
-            test_images: Array of test images
-            test_labels: Array of test labels
+            test_images: Array of test images, or an iterable of (images, labels)
+                batches (e.g. ShardedDataset.iter_batches()) when test_labels is None
+            test_labels: Array of test labels (1 = Melanoma, 0 = Benign)
+            batch_size: Batch size used when slicing test_images
+            n_workers: Number of threads scoring batches concurrently
+            **evaluator_kwargs: Passed through to evaluation.StreamingEvaluator
             
         Returns:
             Dictionary of evaluation metrics
         """
-        # This would evaluate the model on a test dataset
-        # In a real implementation, this would calculate accuracy, precision, recall, etc.
+        if test_labels is None:
+            batches = test_images
+        else:
+            if len(test_images) != len(test_labels):
+                raise ValueError("test_images and test_labels must have the same length")
+            batches = (
+                (test_images[start:start + batch_size], test_labels[start:start + batch_size])
+                for start in range(0, len(test_images), batch_size)
+            )
         
-        # For the prototype, we return simulated metrics
-        return {
-            "accuracy": 0.89,
-            "precision": 0.86,
-            "recall": 0.82,
-            "f1_score": 0.84
-        }
+        return evaluate_batches(self.predict_proba, batches, n_workers=n_workers, **evaluator_kwargs)
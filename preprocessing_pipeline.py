@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PipelineStage:
+    """
+    A named preprocessing step: a function of (image, **params) -> image.
+
+    Stage functions must return a new array and must not modify their input,
+    since cached outputs of earlier stages are passed to them directly. Stages
+    created with inplace=True additionally accept an ``out`` argument, which the
+    pipeline sets to the input array when it owns it and nothing is cached.
+    """
+
+    def __init__(self, name, func, inplace=False, **params):
+        self.name = name
+        self.func = func
+        self.inplace = inplace
+        self.params = params
+
+    def __call__(self, image):
+        return self.func(image, **self.params)
+
+    def __repr__(self):
+        return f"PipelineStage({self.name!r}, {self.params!r})"
+
+    def with_params(self, **params):
+        """Returns a copy of the stage with some parameters overridden."""
+        return PipelineStage(self.name, self.func, inplace=self.inplace, **{**self.params, **params})
+
+    def fingerprint(self):
+        """Stable string identifying the stage and its parameters."""
+        return f"{self.name}:{json.dumps(self.params, sort_keys=True, default=repr)}"
+
+
+class StageCache:
+    """
+    LRU cache of intermediate stage outputs, bounded by total array size.
+
+    If cache_dir is given, entries are also written there as .npy files so they
+    survive across runs and processes; the in-memory LRU sits in front of it.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Returns the cached array for key, or None."""
+        array = self._lookup(key)
+        self._count(array is not None)
+        return array
+
+    def get_deepest(self, keys):
+        """
+        Find the last key in keys that is cached, counting one hit or miss in total.
+
+        Returns:
+            Tuple of (index, array), or (-1, None) if none of the keys are cached
+        """
+        for idx in range(len(keys) - 1, -1, -1):
+            array = self._lookup(keys[idx])
+            if array is not None:
+                self._count(True)
+                return idx, array
+        self._count(False)
+        return -1, None
+
+    def put(self, key, array):
+        """Store an array; it is made read-only so later stages cannot mutate it."""
+        array.flags.writeable = False
+        self._remember(key, array)
+        if self.cache_dir is not None:
+            np.save(self._path(key), array)
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        if self.cache_dir is not None:
+            path = self._path(key)
+            if os.path.exists(path):
+                array = np.load(path)
+                # Shared with later callers, so protect it like arrays stored by put()
+                array.flags.writeable = False
+                self._remember(key, array)
+                return array
+
+        return None
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remember(self, key, array):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = array
+            self._size += array.nbytes
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.nbytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+
+def hash_array(array):
+    """Content hash of an array, including its shape and dtype."""
+    digest = hashlib.sha1()
+    digest.update(f"{array.shape}{array.dtype}".encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+class PreprocessingPipeline:
+    """
+    An ordered list of PipelineStages with optional per-stage memoization.
+
+    The cache key of a stage's output is derived from the input hash and the
+    fingerprints of that stage and every stage before it. Changing a parameter
+    therefore only invalidates the changed stage and the ones after it; running
+    the modified pipeline resumes from the last cached unchanged stage.
+    """
+
+    def __init__(self, stages, cache=None):
+        """
+        Args:
+            stages: List of PipelineStage objects, in execution order
+            cache: Optional StageCache shared by all runs of this pipeline
+        """
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Stage names must be unique, got {names}")
+        self.stages = list(stages)
+        self.cache = cache
+
+    def __repr__(self):
+        return f"PreprocessingPipeline({self.stages!r})"
+
+    @property
+    def stage_names(self):
+        return [stage.name for stage in self.stages]
+
+    def stage(self, name):
+        """Returns the stage with the given name."""
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(f"No stage named '{name}' in pipeline {self.stage_names}")
+
+    def with_stage_params(self, name, **params):
+        """
+        Returns a new pipeline, sharing this pipeline's cache, with one stage's
+        parameters overridden.
+        """
+        self.stage(name)
+        stages = [stage.with_params(**params) if stage.name == name else stage for stage in self.stages]
+        return PreprocessingPipeline(stages, cache=self.cache)
+
+    def stage_keys(self, input_key):
+        """Cache keys of each stage's output for an input with the given hash."""
+        keys = []
+        key = input_key
+        for stage in self.stages:
+            key = hashlib.sha1(f"{key}|{stage.fingerprint()}".encode()).hexdigest()
+            keys.append(key)
+        return keys
+
+    def run(self, image, input_key=None, inplace=True):
+        """
+        Run the pipeline on an image array.
+
+        Args:
+            image: Input image array (not modified)
+            input_key: Optional precomputed content hash of image (e.g. of the
+                source file); computed from the array when omitted
+            inplace: Let in-place capable stages overwrite intermediate arrays
+                instead of allocating new ones; only applies without a cache
+
+        Returns:
+            Output array of the last stage
+        """
+        if self.cache is None:
+            # The caller's array is never written; arrays produced by earlier
+            # stages are owned by the pipeline and can be reused
+            owned = False
+            for stage in self.stages:
+                if owned and inplace and stage.inplace:
+                    image = stage.func(image, out=image, **stage.params)
+                else:
+                    image = stage(image)
+                    owned = True
+            return image
+
+        keys = self.stage_keys(input_key or hash_array(image))
+
+        # Resume after the deepest stage whose output is already cached
+        idx, cached = self.cache.get_deepest(keys)
+        start = idx + 1
+        if cached is not None:
+            image = cached
+
+        for stage, key in zip(self.stages[start:], keys[start:]):
+            image = stage(image)
+            self.cache.put(key, image)
+
+        return image
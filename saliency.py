@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+
+
+def occlusion_positions(length, patch_size, stride):
+    """
+    Start offsets of occlusion patches along one axis.
+
+    The last patch is aligned to the image edge so the whole axis is covered.
+    """
+    if patch_size >= length:
+        return [0]
+    positions = list(range(0, length - patch_size + 1, stride))
+    if positions[-1] != length - patch_size:
+        positions.append(length - patch_size)
+    return positions
+
+
+def occlusion_sensitivity(model, image, patch_size=32, stride=16, max_patches=100, fill_value=None,
+                          chunk_size=32):
+    """
+    Compute an occlusion-sensitivity map for a preprocessed image.
+
+    Occluded variants are generated and scored in chunks of chunk_size images
+    with one predict_proba call each, so peak memory is bounded by the chunk
+    rather than by the patch budget. If the stride yields more than max_patches
+    patches, the stride is increased until the grid fits the budget.
+
+    Args:
+        model: Classifier exposing predict_proba(images, stochastic=False)
+        image: Preprocessed image array of shape (H, W, 3)
+        patch_size: Side length of the square occluding patch in pixels
+        stride: Requested distance between patch positions in pixels
+        max_patches: Maximum number of occluded variants (forward passes) to score
+        fill_value: Value used to occlude; defaults to the per-channel image mean
+        chunk_size: Maximum number of images per predict_proba call
+
+    Returns:
+        Tuple of (heatmap, base_probability). The heatmap has shape (H, W) and holds
+        the drop in melanoma probability when each pixel is occluded, averaged over
+        the patches covering it; negative values mean occlusion raised the probability.
+
+    Raises:
+        ValueError: If no patch grid of this patch_size fits within max_patches
+    """
+    height, width = image.shape[:2]
+    min_patches = len(occlusion_positions(height, patch_size, height)) * len(occlusion_positions(width, patch_size, width))
+    if max_patches < min_patches:
+        raise ValueError(
+            f"max_patches={max_patches} is below the {min_patches} patches needed to cover a "
+            f"{height}x{width} image with patch_size={patch_size}; raise max_patches or patch_size"
+        )
+    while True:
+        ys = occlusion_positions(height, patch_size, stride)
+        xs = occlusion_positions(width, patch_size, stride)
+        if len(ys) * len(xs) <= max_patches:
+            break
+        stride += 1
+
+    if fill_value is None:
+        fill_value = image.reshape(-1, image.shape[-1]).mean(axis=0).astype(image.dtype)
+
+    # Row 0 of the first chunk is the unoccluded image, so the baseline is scored
+    # alongside the variants; the scoring is deterministic, so chunks are comparable
+    positions = [None] + [(y, x) for y in ys for x in xs]
+    probabilities = np.empty(len(positions), dtype=np.float64)
+    batch = np.empty((min(chunk_size, len(positions)),) + image.shape, dtype=image.dtype)
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start:start + chunk_size]
+        chunk_batch = batch[:len(chunk)]
+        chunk_batch[:] = image
+        for i, position in enumerate(chunk):
+            if position is not None:
+                y, x = position
+                chunk_batch[i, y:y + patch_size, x:x + patch_size] = fill_value
+        probabilities[start:start + len(chunk)] = model.predict_proba(chunk_batch, stochastic=False)
+
+    base_probability = float(probabilities[0])
+    drops = base_probability - probabilities[1:]
+
+    heatmap = np.zeros((height, width), dtype=np.float32)
+    coverage = np.zeros((height, width), dtype=np.float32)
+    for (y, x), drop in zip(positions[1:], drops):
+        heatmap[y:y + patch_size, x:x + patch_size] += drop
+        coverage[y:y + patch_size, x:x + patch_size] += 1
+    heatmap /= np.maximum(coverage, 1)
+
+    return heatmap, base_probability
+
+
+def render_saliency_overlay(image, heatmap, prediction, alpha=0.45):
+    """
+    Blend a saliency heatmap over the image for display.
+
+    Args:
+        image: Preprocessed image array of shape (H, W, 3) with values in [0, 1]
+        heatmap: Output of occlusion_sensitivity
+        prediction: Predicted label; regions supporting this label are highlighted
+        alpha: Opacity of the heatmap
+
+    Returns:
+        RGB uint8 image of shape (H, W, 3)
+    """
+    # A drop in melanoma probability supports "Melanoma"; a rise supports "Benign"
+    support = heatmap if prediction == "Melanoma" else -heatmap
+    support = np.clip(support, 0, None)
+    peak = support.max()
+    if peak > 0:
+        support = support / peak
+
+    colored = cv2.applyColorMap((support * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    colored = cv2.cvtColor(colored, cv2.COLOR_BGR2RGB)
+    base = np.clip(image * 255.0, 0, 255).astype(np.uint8)
+
+    return cv2.addWeighted(base, 1.0 - alpha, colored, alpha, 0)
@@ -0,0 +1,328 @@
+import atexit
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_DB_PATH = "scantech_sessions.db"
+
+# Errors that retrying the same statement cannot fix; other sqlite3 errors
+# (e.g. OperationalError for a locked database or a full disk) are transient
+PERMANENT_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError, sqlite3.DataError)
+
+logger = logging.getLogger(__name__)
+
+# Message bodies at least this long are zlib-compressed before storage
+COMPRESSION_THRESHOLD = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    current_stage TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content BLOB NOT NULL,
+    compressed INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+CREATE TABLE IF NOT EXISTS responses (
+    session_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (session_id, question)
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    prediction TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    agreement REAL,
+    n_images INTEGER NOT NULL,
+    per_image TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_session ON results (session_id, id);
+"""
+
+EXPORT_QUERIES = {
+    "results": "SELECT session_id, prediction, confidence, agreement, n_images, per_image, created_at "
+               "FROM results {where} ORDER BY id",
+    "messages": "SELECT session_id, role, content, compressed, created_at FROM messages {where} ORDER BY id",
+    "responses": "SELECT session_id, question, answer, updated_at FROM responses {where} ORDER BY session_id",
+}
+
+
+def _encode_text(text):
+    """Returns (blob, compressed) for a message body."""
+    data = text.encode("utf-8")
+    if len(data) >= COMPRESSION_THRESHOLD:
+        return zlib.compress(data), 1
+    return data, 0
+
+
+def _decode_text(blob, compressed):
+    data = zlib.decompress(blob) if compressed else blob
+    return data.decode("utf-8")
+
+
+class ConversationStore:
+    """
+    SQLite-backed persistence for chat sessions, questionnaire answers and results.
+
+    The database runs in WAL mode so exports and audits can read while the app
+    writes. Writes are buffered and committed in batches, either when batch_size
+    statements are pending or on an explicit flush(); a background thread also
+    commits pending writes every flush_interval seconds, so a write is never
+    held longer than that even if no further writes arrive. A statement that
+    fails permanently (e.g. a constraint violation) is logged and dropped so it
+    cannot block the rest of the batch; after a transient error the batch is
+    kept and retried. The store is safe to share between threads.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, batch_size=32, flush_interval=2.0):
+        """
+        Args:
+            path: Path to the SQLite database file
+            batch_size: Number of pending writes that triggers a commit
+            flush_interval: Seconds between background commits of pending writes
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._closed = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        self._stop_flusher = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="store-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def touch_session(self, session_id, current_stage=None):
+        """Create the session if needed and record its current stage."""
+        now = time.time()
+        self._write(
+            "INSERT INTO sessions (session_id, created_at, updated_at, current_stage) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at, "
+            "current_stage = COALESCE(excluded.current_stage, sessions.current_stage)",
+            (session_id, now, now, current_stage),
+        )
+
+    def add_message(self, session_id, role, content):
+        """Append a chat message to the session."""
+        blob, compressed = _encode_text(content)
+        self._write(
+            "INSERT INTO messages (session_id, role, content, compressed, created_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, role, blob, compressed, time.time()),
+        )
+
+    def save_responses(self, session_id, user_responses):
+        """Upsert the answers collected by ChatbotInterface.process_message."""
+        now = time.time()
+        for question, answer in user_responses.items():
+            self._write(
+                "INSERT INTO responses (session_id, question, answer, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id, question) DO UPDATE SET answer = excluded.answer, "
+                "updated_at = excluded.updated_at",
+                (session_id, question, answer, now),
+            )
+
+    def add_result(self, session_id, prediction, confidence, per_image_predictions=None, agreement=None):
+        """
+        Record an analysis result; committed immediately.
+        
+        Raises:
+            ValueError: If confidence is not a finite percentage or agreement is
+                not None or a fraction in [0, 1]
+        """
+        confidence = float(confidence)
+        if not (math.isfinite(confidence) and 0 <= confidence <= 100):
+            raise ValueError(f"confidence must be a percentage in [0, 100], got {confidence}")
+        if agreement is not None:
+            agreement = float(agreement)
+            if not (math.isfinite(agreement) and 0 <= agreement <= 1):
+                raise ValueError(f"agreement must be a fraction in [0, 1], got {agreement}")
+        
+        per_image = None
+        if per_image_predictions is not None:
+            # Compact encoding: [[label, confidence], ...] with confidences to 0.1%
+            per_image = json.dumps(
+                [[label, round(float(conf), 1)] for label, conf in per_image_predictions],
+                separators=(",", ":"),
+            )
+        self._write(
+            "INSERT INTO results (session_id, prediction, confidence, agreement, n_images, per_image, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, prediction, confidence, agreement,
+             len(per_image_predictions) if per_image_predictions is not None else 1, per_image, time.time()),
+        )
+        self.flush()
+
+    def flush(self):
+        """Commit all pending writes in one transaction."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Stop the background flusher, commit pending writes and close the database."""
+        self._stop_flusher.set()
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._flush_locked()
+            except sqlite3.Error as e:
+                logger.error("Discarding %d uncommitted writes on close: %s", len(self._pending), e)
+            finally:
+                self._conn.close()
+                self._closed = True
+
+    def load_session(self, session_id, max_messages=None):
+        """
+        Load a session for resumption.
+
+        Args:
+            session_id: Identifier of the session
+            max_messages: If given, only the most recent messages are returned
+
+        Returns:
+            Dictionary with current_stage, chat_history, user_responses and the
+            latest result (or None), or None if the session does not exist
+        """
+        self.flush()
+        with self._lock:
+            session = self._conn.execute(
+                "SELECT current_stage FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if session is None:
+                return None
+
+            limit = -1 if max_messages is None else max_messages
+            messages = self._conn.execute(
+                "SELECT role, content, compressed FROM "
+                "(SELECT id, role, content, compressed FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?) "
+                "ORDER BY id",
+                (session_id, limit),
+            ).fetchall()
+            responses = self._conn.execute(
+                "SELECT question, answer FROM responses WHERE session_id = ?", (session_id,)
+            ).fetchall()
+            result = self._conn.execute(
+                "SELECT prediction, confidence, agreement, per_image FROM results "
+                "WHERE session_id = ? ORDER BY id DESC LIMIT 1",
+                (session_id,),
+            ).fetchone()
+
+        latest_result = None
+        if result is not None:
+            prediction, confidence, agreement, per_image = result
+            latest_result = {
+                "prediction": prediction,
+                "confidence": confidence,
+                "agreement": agreement,
+                "per_image_predictions": [tuple(p) for p in json.loads(per_image)] if per_image else None,
+            }
+
+        return {
+            "current_stage": session[0],
+            "chat_history": [
+                {"role": role, "content": _decode_text(content, compressed)}
+                for role, content, compressed in messages
+            ],
+            "user_responses": dict(responses),
+            "result": latest_result,
+        }
+
+    def iter_export(self, table="results", session_id=None, chunk_size=500):
+        """
+        Stream rows of a table as dictionaries.
+
+        Uses its own read-only connection and fetches chunk_size rows at a time,
+        so exports of any size run in constant memory without blocking writers.
+
+        Args:
+            table: One of "results", "messages" or "responses"
+            session_id: Optionally restrict the export to one session
+            chunk_size: Number of rows fetched per round trip
+
+        Yields:
+            One dictionary per row
+        """
+        if table not in EXPORT_QUERIES:
+            raise ValueError(f"Unknown table '{table}', expected one of {list(EXPORT_QUERIES)}")
+        self.flush()
+
+        where, params = ("WHERE session_id = ?", (session_id,)) if session_id is not None else ("", ())
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            cursor = conn.execute(EXPORT_QUERIES[table].format(where=where), params)
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(zip(columns, row))
+                    if table == "messages":
+                        record["content"] = _decode_text(record["content"], record.pop("compressed"))
+                    elif table == "results" and record["per_image"]:
+                        record["per_image"] = json.loads(record["per_image"])
+                    yield record
+        finally:
+            conn.close()
+
+    def _write(self, sql, params):
+        with self._lock:
+            self._pending.append((sql, params))
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def _flush_periodically(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # Keep the writes pending and retry on the next tick
+                pass
+
+    def _flush_locked(self):
+        if not self._pending or self._closed:
+            return
+        try:
+            with self._conn:
+                for sql, params in self._pending:
+                    self._conn.execute(sql, params)
+        except PERMANENT_ERRORS:
+            # The batch was rolled back; commit the statements one at a time
+            # to find and drop the ones that can never succeed
+            self._flush_one_by_one_locked()
+        self._pending = []
+
+    def _flush_one_by_one_locked(self):
+        while self._pending:
+            sql, params = self._pending[0]
+            try:
+                with self._conn:
+                    self._conn.execute(sql, params)
+            except PERMANENT_ERRORS as e:
+                logger.error("Dropping write that cannot be committed (%s): %s %r", e, sql, params)
+            # Transient errors propagate with this and the later statements still pending
+            self._pending.pop(0)